@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 import psycopg2
 
 def try_connect(user, password, dbname="postgres"):
@@ -19,11 +20,20 @@ def try_connect(user, password, dbname="postgres"):
     except Exception as e:
         return f"FAILED: {user} / {password} -> {str(e)}\n"
 
-results = []
-results.append(try_connect("gameuser", "swarna"))
-results.append(try_connect("gameuser", "swarna_00_"))
-results.append(try_connect("postgres", "swarna"))
-results.append(try_connect("postgres", "swarna_00_"))
+CREDENTIALS = [
+    ("gameuser", "swarna"),
+    ("gameuser", "swarna_00_"),
+    ("postgres", "swarna"),
+    ("postgres", "swarna_00_"),
+]
 
-with open("db_results.txt", "w", encoding="utf-8") as f:
-    f.writelines(results)
+def main():
+    # Connection attempts are blocking I/O, so run them side by side
+    with ThreadPoolExecutor(max_workers=len(CREDENTIALS)) as executor:
+        results = list(executor.map(lambda creds: try_connect(*creds), CREDENTIALS))
+
+    with open("db_results.txt", "w", encoding="utf-8") as f:
+        f.writelines(results)
+
+if __name__ == "__main__":
+    main()
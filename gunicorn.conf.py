@@ -0,0 +1,42 @@
+import multiprocessing
+import os
+
+# Gunicorn configuration (picked up automatically from the project root).
+# The app is I/O bound (PostgreSQL, OAuth HTTPS), so gevent workers serve many
+# concurrent requests each. Set GUNICORN_WORKER_CLASS=gthread to compare.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gevent')
+workers = int(os.getenv('WEB_CONCURRENCY', max(2, multiprocessing.cpu_count())))
+preload_app = True
+
+# Recycle workers periodically to cap memory growth from leaks
+max_requests = 1000
+max_requests_jitter = 100
+
+# gevent: each worker's greenlets share one DB pool of DB_POOL_SIZE +
+# DB_MAX_OVERFLOW connections (30 by default); greenlets beyond that queue for
+# up to pool_timeout (10s) and then fail. Keep this close to the pool capacity
+# and raise both together. The gevent worker monkey-patches itself after fork.
+worker_connections = int(os.getenv('WORKER_CONNECTIONS', '50'))
+
+# gthread: keep DB_POOL_SIZE >= threads so every worker thread can hold a connection.
+threads = int(os.getenv('WEB_THREADS', '8'))
+
+
+def post_fork(server, worker):
+    """Give each forked worker its own connection pool.
+
+    With preload_app the engine is created in the master process, so the
+    pooled sockets must not be shared with the children. The app is taken
+    from gunicorn rather than imported, so this works for any module path
+    (``server_postgresql:app`` or ``web.server_postgresql:app``).
+    """
+    app = worker.app.wsgi()
+    db = app.extensions['sqlalchemy']
+
+    # Branch on the effective setting so `-k gthread` on the command line counts
+    if 'gevent' in server.cfg.worker_class_str:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+    with app.app_context():
+        db.engine.dispose(close=False)
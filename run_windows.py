@@ -12,4 +12,14 @@ if __name__ == '__main__':
     print(f"🔗 Local access: http://localhost:{port}")
     
     # Run the app with waitress (the Windows-friendly production server)
-    serve(app, host='0.0.0.0', port=port, threads=4)
+    serve(
+        app,
+        host='0.0.0.0',
+        port=port,
+        threads=int(os.environ.get('WAITRESS_THREADS', 16)),
+        channel_timeout=30,
+        cleanup_interval=30,
+        # Windows has no poll(), so waitress uses select(), which is capped at
+        # 512 sockets there; stay below that.
+        connection_limit=int(os.environ.get('WAITRESS_CONNECTION_LIMIT', 400)),
+    )
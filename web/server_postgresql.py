@@ -1,12 +1,23 @@
-from flask import Flask, render_template, request, session, redirect, url_for, jsonify
+from flask import Flask, render_template, request, session, redirect, url_for, jsonify, make_response
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func
+from sqlalchemy.ext.mutable import MutableList
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from authlib.integrations.flask_client import OAuth
-from datetime import datetime, timedelta
+from cachetools import TTLCache, cached
+from datetime import datetime, timedelta, timezone
+import atexit
 import logging
-import json
+from logging.handlers import MemoryHandler
 import sys
 import os
+import random
+import threading
+import time
+import orjson
+import requests
+import structlog
 from dotenv import load_dotenv
 from flask_seasurf import SeaSurf
 from flask_limiter import Limiter
@@ -22,13 +33,28 @@ from werkzeug.middleware.proxy_fix import ProxyFix
 app = Flask(__name__)
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
 
+# ----- JSON responses via orjson (compact, unsorted keys) -----
+class ORJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        # OPT_NON_STR_KEYS keeps the stdlib behaviour of stringifying int/etc. keys
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+app.json = ORJSONProvider(app)
+
 # Security Extensions
 csrf = SeaSurf(app)
 limiter = Limiter(
     get_remote_address,
     app=app,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://",
+    # Shared storage so limits hold across all gunicorn workers
+    storage_uri=os.getenv('RATELIMIT_STORAGE_URL', 'redis://localhost:6379/1'),
+    strategy="moving-window",
+    # Keep serving (with per-process counters) if Redis is unreachable
+    in_memory_fallback_enabled=True,
 )
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-change-in-production')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv(
@@ -37,6 +63,25 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv(
 )
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Connection pool sized for gunicorn threads per worker (see gunicorn.conf.py).
+# pool_pre_ping drops dead connections; pool_recycle avoids server-side idle timeouts.
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': int(os.getenv('DB_POOL_SIZE', '10')),
+    'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '20')),
+    'pool_timeout': 10,
+    'pool_pre_ping': True,
+    'pool_recycle': 1800,
+    # Larger compiled-SQL cache so every statement in this app stays cached
+    'query_cache_size': 1200,
+}
+
+# libpq startup options; Postgres JIT only adds overhead to the small OLTP
+# queries here. Set DB_CONNECT_OPTIONS= (empty) for poolers such as PgBouncer
+# that reject the 'options' startup parameter. Only sent to PostgreSQL URLs.
+DB_CONNECT_OPTIONS = os.getenv('DB_CONNECT_OPTIONS', '-c jit=off').strip()
+if DB_CONNECT_OPTIONS and app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgres'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS']['connect_args'] = {'options': DB_CONNECT_OPTIONS}
+
 # ----- Production / security settings (override via environment) -----
 # Use env vars to control these in production
 app.config['ENV'] = os.getenv('FLASK_ENV', 'production')
@@ -55,10 +100,49 @@ except (ValueError, TypeError):
     app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=1)
 
 # ----- Structured JSON logging for production-friendly logs -----
+# Application logs go through structlog, rendered with orjson straight to
+# stdout as bytes, bypassing the stdlib logging machinery. Keys match the
+# stdlib bridge below (time / level / message) so both share one log shape.
+log_level = logging.DEBUG if app.config['DEBUG'] else logging.INFO
+
+def _match_bridge_fields(logger, method_name, event_dict):
+    """Use the bridge's level casing and traceback key"""
+    event_dict['level'] = event_dict['level'].upper()
+    if 'exception' in event_dict:
+        event_dict['exc_info'] = event_dict.pop('exception')
+    return event_dict
+
+structlog.configure(
+    processors=[
+        structlog.processors.add_log_level,
+        structlog.processors.TimeStamper(fmt='iso', utc=True, key='time'),
+        structlog.processors.format_exc_info,
+        _match_bridge_fields,
+        structlog.processors.EventRenamer('message'),
+        structlog.processors.JSONRenderer(serializer=orjson.dumps),
+    ],
+    wrapper_class=structlog.make_filtering_bound_logger(log_level),
+    logger_factory=structlog.BytesLoggerFactory(),
+    cache_logger_on_first_use=True,
+)
+log = structlog.get_logger()
+
+# Fraction of logged errors that include a full (expensive) traceback
+ERROR_TRACE_SAMPLE_RATE = float(os.getenv('ERROR_TRACE_SAMPLE_RATE', '0.1'))
+
+def log_error_sampled(msg, exc, rate=ERROR_TRACE_SAMPLE_RATE):
+    """Log an error, attaching the traceback only for a sample of calls"""
+    if random.random() < rate:
+        log.error(msg, error=repr(exc), exc_info=exc)
+    else:
+        log.error(msg, error=repr(exc))
+
+# Minimal stdlib bridge for third-party libraries (werkzeug, sqlalchemy, ...)
 class JSONFormatter(logging.Formatter):
     def format(self, record):
         log_record = {
-            'time': self.formatTime(record, self.datefmt),
+            # Same ISO-8601 UTC format as structlog's TimeStamper
+            'time': datetime.fromtimestamp(record.created, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
             'level': record.levelname,
             'logger': record.name,
             'message': record.getMessage(),
@@ -72,47 +156,111 @@ class JSONFormatter(logging.Formatter):
         if hasattr(record, 'request_id'):
             log_record['request_id'] = record.request_id
             
-        return json.dumps(log_record, ensure_ascii=False)
+        return orjson.dumps(log_record).decode()
+
+class BufferedLogHandler(MemoryHandler):
+    """MemoryHandler that writes a whole batch of records in one go.
+
+    The stock MemoryHandler replays records through the target one by one,
+    which still flushes the stream (one write syscall) per record. Records
+    are never held longer than max_age seconds once another record arrives
+    or a request finishes.
+    """
+    def __init__(self, *args, max_age=2.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_age = max_age
+
+    def buffer_expired(self):
+        """True if the oldest buffered record has waited longer than max_age"""
+        buffer = self.buffer
+        return bool(buffer) and time.time() - buffer[0].created >= self.max_age
+
+    def shouldFlush(self, record):
+        return super().shouldFlush(record) or self.buffer_expired()
+
+    def flush(self):
+        with self.lock:
+            target = self.target
+            if not (target and self.buffer):
+                return
+            try:
+                chunks = []
+                for record in self.buffer:
+                    if record.levelno < target.level or not target.filter(record):
+                        continue
+                    try:
+                        chunks.append(target.format(record) + target.terminator)
+                    except Exception:
+                        self.handleError(record)
+                if chunks:
+                    with target.lock:
+                        try:
+                            target.stream.write(''.join(chunks))
+                            target.flush()
+                        except Exception:
+                            self.handleError(self.buffer[-1])
+            finally:
+                self.buffer.clear()
 
 # Configure root and app loggers (stream to stdout for container friendliness)
 json_handler = logging.StreamHandler(stream=sys.stdout)
 json_handler.setFormatter(JSONFormatter())
 
-# Set logging level based on environment
-log_level = logging.DEBUG if app.config['DEBUG'] else logging.INFO
-json_handler.setLevel(log_level)
+# Batch records in memory; warnings and errors flush immediately, and nothing
+# waits longer than LOG_BUFFER_MAX_AGE seconds past the next log call or request
+log_buffer = BufferedLogHandler(
+    capacity=int(os.getenv('LOG_BUFFER_CAPACITY', '200')),
+    flushLevel=logging.WARNING,
+    max_age=float(os.getenv('LOG_BUFFER_MAX_AGE', '2')),
+    target=json_handler,
+    flushOnClose=True,
+)
+log_buffer.setLevel(log_level)
+atexit.register(log_buffer.flush)
 
 root_logger = logging.getLogger()
 # Clear existing handlers to avoid duplicates
 for handler in root_logger.handlers[:]:
     root_logger.removeHandler(handler)
-root_logger.addHandler(json_handler)
+root_logger.addHandler(log_buffer)
 root_logger.setLevel(log_level)
 
 # Explicitly set Flask's logger to use our handler
 app.logger.handlers = root_logger.handlers
 app.logger.setLevel(log_level)
 
-@app.after_request
-def add_security_headers(response):
-    """Add security headers to every response engine"""
-    response.headers['X-Content-Type-Options'] = 'nosniff'
-    response.headers['X-Frame-Options'] = 'SAMEORIGIN'
-    response.headers['X-XSS-Protection'] = '1; mode=block'
-    response.headers['Content-Security-Policy'] = (
+# Security headers are identical for every response; build them once
+SECURITY_HEADERS = (
+    ('X-Content-Type-Options', 'nosniff'),
+    ('X-Frame-Options', 'SAMEORIGIN'),
+    ('X-XSS-Protection', '1; mode=block'),
+    ('Content-Security-Policy', (
         "default-src 'self'; "
         "script-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net https://cdnjs.cloudflare.com; "
         "style-src 'self' 'unsafe-inline' https://fonts.googleapis.com https://cdn.jsdelivr.net https://cdnjs.cloudflare.com; "
         "font-src 'self' https://fonts.gstatic.com https://cdnjs.cloudflare.com; "
         "img-src 'self' data: https:; "
         "connect-src 'self';"
-    )
+    )),
+)
+HSTS_HEADER = ('Strict-Transport-Security', 'max-age=31536000; includeSubDomains')
+
+@app.after_request
+def add_security_headers(response):
+    """Add security headers to every response engine"""
+    response.headers.update(SECURITY_HEADERS)
     
     if app.config.get('SESSION_COOKIE_SECURE'):
-        response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
+        response.headers.set(*HSTS_HEADER)
         
     return response
 
+@app.teardown_appcontext
+def flush_log_buffer(error):
+    """Write out buffered logs when a request failed or they have waited too long"""
+    if error is not None or log_buffer.buffer_expired():
+        log_buffer.flush()
+
 # Initialize Database
 db = SQLAlchemy(app)
 
@@ -126,6 +274,24 @@ oauth = OAuth(app)
 GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID', '').strip()
 GOOGLE_CLIENT_SECRET = os.getenv('GOOGLE_CLIENT_SECRET', '').strip()
 OAUTH_ENABLED = bool(GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET)
+GOOGLE_METADATA_URL = 'https://accounts.google.com/.well-known/openid-configuration'
+
+def prefetch_server_metadata(client, url):
+    """Seed an OAuth client with its OIDC discovery document.
+
+    Fetched once at startup (inherited by preloaded gunicorn workers). The
+    '_loaded_at' marker is what authlib checks before fetching on its own; if
+    the prefetch fails, authlib falls back to lazy discovery from the URL.
+    """
+    try:
+        resp = requests.get(url, timeout=3)
+        resp.raise_for_status()
+        metadata = resp.json()
+    except (requests.RequestException, ValueError) as e:
+        log.warning("OIDC metadata prefetch failed", url=url, error=repr(e))
+        return
+    metadata['_loaded_at'] = time.time()
+    client.server_metadata.update(metadata)
 
 if OAUTH_ENABLED:
     app.config['GOOGLE_CLIENT_ID'] = GOOGLE_CLIENT_ID
@@ -135,9 +301,10 @@ if OAUTH_ENABLED:
         name='google',
         client_id=GOOGLE_CLIENT_ID,
         client_secret=GOOGLE_CLIENT_SECRET,
-        server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
+        server_metadata_url=GOOGLE_METADATA_URL,
         client_kwargs={'scope': 'openid email profile'}
     )
+    prefetch_server_metadata(google, GOOGLE_METADATA_URL)
 else:
     google = None
 
@@ -166,6 +333,13 @@ class User(UserMixin, db.Model):
 class PlayerProfile(db.Model):
     """Player statistics and profile"""
     __tablename__ = 'player_profiles'
+    __table_args__ = (
+        # Partial index backing the leaderboard (ORDER BY best_score ... LIMIT n)
+        db.Index(
+            'ix_profile_best_score', 'best_score', 'games_won',
+            postgresql_where=db.text('best_score IS NOT NULL')
+        ),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), unique=True, nullable=False)
@@ -176,7 +350,7 @@ class PlayerProfile(db.Model):
     total_attempts = db.Column(db.Integer, default=0)
     current_streak = db.Column(db.Integer, default=0)
     best_streak = db.Column(db.Integer, default=0)
-    achievements = db.Column(db.JSON, default=list)
+    achievements = db.Column(MutableList.as_mutable(db.JSON), default=list)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationship
@@ -195,7 +369,7 @@ class Game(db.Model):
     attempts = db.Column(db.Integer, nullable=False)
     won = db.Column(db.Boolean, default=False)
     secret_number = db.Column(db.Integer, nullable=False)
-    guesses = db.Column(db.JSON, default=list)  # List of all guesses made
+    guesses = db.Column(MutableList.as_mutable(db.JSON), default=list)  # List of all guesses made
     played_at = db.Column(db.DateTime, default=datetime.utcnow)
     completed_at = db.Column(db.DateTime, nullable=True)
     
@@ -209,7 +383,7 @@ class Game(db.Model):
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return db.session.get(User, int(user_id))
 
 # ============== AUTHENTICATION ROUTES ==============
 
@@ -223,16 +397,12 @@ def login():
         if not nickname or len(nickname) < 2 or len(nickname) > 20:
             return render_template('login.html', error='Invalid nickname (2-20 characters)')
         
-        # Create guest user
+        # Create guest user with profile (cascade inserts both in one transaction)
         guest_user = User(name=nickname, email=f'guest_{nickname}@local')
+        guest_user.profile = PlayerProfile()
         db.session.add(guest_user)
         db.session.commit()
         
-        # Create profile
-        profile = PlayerProfile(user_id=guest_user.id)
-        db.session.add(profile)
-        db.session.commit()
-        
         login_user(guest_user)
         session['player_name'] = nickname
         return redirect(url_for('game'))
@@ -247,10 +417,10 @@ def login_google():
         return redirect(url_for('login'))
     try:
         redirect_uri = url_for('authorize_google', _external=True)
-        app.logger.info(f"Initiating Google OAuth with redirect_uri: {redirect_uri}")
+        log.info("Initiating Google OAuth", redirect_uri=redirect_uri)
         return google.authorize_redirect(redirect_uri, prompt='select_account')
     except Exception as e:
-        app.logger.error(f"Google OAuth redirect error: {repr(e)}")
+        log_error_sampled("Google OAuth redirect error", e)
         return redirect(url_for('login'))
 
 @app.route('/authorize/google')
@@ -267,28 +437,24 @@ def authorize_google():
             user = User.query.filter_by(google_id=user_info['sub']).first()
             
             if not user:
-                # Create new user
+                # Create new user with profile (cascade inserts both in one transaction)
                 user = User(
                     google_id=user_info['sub'],
                     email=user_info['email'],
                     name=user_info['name'],
                     avatar_url=user_info.get('picture')
                 )
+                user.profile = PlayerProfile()
                 db.session.add(user)
                 db.session.commit()
-                
-                # Create profile
-                profile = PlayerProfile(user_id=user.id)
-                db.session.add(profile)
-                db.session.commit()
             
             login_user(user)
             session['player_name'] = user.name
             session['user_email'] = user.email
-            app.logger.info(f"User {user.name} logged in via Google OAuth")
+            log.info("User logged in via Google OAuth", user=user.name)
             return redirect(url_for('game'))
     except Exception as e:
-        app.logger.error(f"Google OAuth Error: {repr(e)}", exc_info=True)
+        log_error_sampled("Google OAuth Error", e)
         return render_template('login.html', error=f'Google login failed: {str(e)}', oauth_enabled=OAUTH_ENABLED)
     
     return redirect(url_for('login'))
@@ -302,6 +468,10 @@ def logout():
 
 # ============== GAME ROUTES ==============
 
+# Number range for each difficulty
+DIFFICULTY_RANGES = {'easy': (1, 50), 'medium': (1, 100), 'hard': (1, 500)}
+DEFAULT_RANGE = (1, 100)
+
 @app.route('/')
 def index():
     """Home - redirect to game or login"""
@@ -365,9 +535,7 @@ def game():
 
 def init_game(user_id, difficulty='medium'):
     """Initialize new game"""
-    import random
-    ranges = {'easy': (1, 50), 'medium': (1, 100), 'hard': (1, 500)}
-    low, high = ranges.get(difficulty, (1, 100))
+    low, high = get_range(difficulty)
     
     game = Game(
         user_id=user_id,
@@ -387,15 +555,16 @@ def get_current_game(user_id):
     if not game_id:
         return None
     
-    game = Game.query.get(game_id)
+    game = db.session.get(Game, game_id)
     if not game or game.user_id != user_id:
         return None
     
+    low, high = get_range(game.difficulty)
     data = {
         'id': game.id,
         'difficulty': game.difficulty,
         'attempts': game.attempts,
-        'message': f'Guess a number between {get_range(game.difficulty)[0]} and {get_range(game.difficulty)[1]}',
+        'message': f'Guess a number between {low} and {high}',
         'feedback_class': 'info'
     }
     
@@ -403,13 +572,12 @@ def get_current_game(user_id):
 
 def get_range(difficulty):
     """Get number range for difficulty"""
-    ranges = {'easy': (1, 50), 'medium': (1, 100), 'hard': (1, 500)}
-    return ranges.get(difficulty, (1, 100))
+    return DIFFICULTY_RANGES.get(difficulty, DEFAULT_RANGE)
 
 def process_guess(user_id, guess):
     """Process player's guess"""
     game_id = session.get('current_game_id')
-    game = Game.query.get(game_id)
+    game = db.session.get(Game, game_id)
     
     if not game or game.user_id != user_id:
         return redirect(url_for('game'))
@@ -425,9 +593,9 @@ def process_guess(user_id, guess):
             attempts=game.attempts,
             difficulty=game.difficulty)
     
+    # Committed once, together with the outcome below (MutableList tracks the append)
     game.attempts += 1
     game.guesses.append(guess)
-    db.session.commit()
     
     message = f'Guess a number between {low} and {high}'
     feedback_class = 'info'
@@ -443,7 +611,6 @@ def process_guess(user_id, guess):
         
         # Update profile
         update_player_profile(user_id, game.attempts)
-        db.session.commit()
         
         session.pop('current_game_id', None)
     else:
@@ -460,8 +627,12 @@ def process_guess(user_id, guess):
         else:
             message = f"❌ Way off! {'Too low' if guess < game.secret_number else 'Too high'}"
             feedback_class = 'error'
-        
-        db.session.commit()
+    
+    db.session.commit()
+    
+    if game_won:
+        # Only after the commit, so a concurrent request can't re-cache pre-win rows
+        clear_leaderboard_cache()
     
     leaderboard = get_leaderboard(5)
     
@@ -513,12 +684,36 @@ def profile():
         player_name=current_user.name,
         profile=profile_data)
 
+def cacheable(body, max_age):
+    """Wrap a rendered page with browser caching headers and an ETag.
+
+    Pages include the per-user navbar, so they are marked private: browsers may
+    cache them, shared proxies/CDNs may not. Matching If-None-Match gets a 304.
+    """
+    resp = make_response(body)
+    resp.cache_control.private = True
+    resp.cache_control.max_age = max_age
+    resp.vary.add('Cookie')
+    resp.add_etag()
+    return resp.make_conditional(request)
+
 @app.route('/leaderboard')
 def leaderboard():
     """Public leaderboard"""
     scores = get_leaderboard(None)
-    return render_template('leaderboard.html', leaderboard=scores)
+    return cacheable(render_template('leaderboard.html', leaderboard=scores), max_age=60)
+
+# Leaderboard only changes when someone wins; serve it from memory for a few seconds.
+# The cache is per worker process and is cleared once a win is committed.
+_leaderboard_cache = TTLCache(maxsize=8, ttl=int(os.getenv('LEADERBOARD_CACHE_TTL', '10')))
+_leaderboard_lock = threading.Lock()
+
+def clear_leaderboard_cache():
+    """Drop cached leaderboards; call after committing a win"""
+    with _leaderboard_lock:
+        _leaderboard_cache.clear()
 
+@cached(_leaderboard_cache, lock=_leaderboard_lock)
 def get_leaderboard(limit=None):
     """Get public leaderboard"""
     query = db.session.query(
@@ -561,28 +756,21 @@ def admin_dashboard():
     if not session.get('admin'):
         return redirect(url_for('admin_login'))
     
-    users = User.query.all()
-    stats_list = []
-    
-    for user in users:
-        profile = user.profile
-        if profile:
-            stats_list.append({
-                'name': user.name,
-                'email': user.email or 'Guest',
-                'games_won': profile.games_won,
-                'games_lost': profile.games_lost,
-                'best_score': profile.best_score,
-                'current_streak': profile.current_streak,
-                'total_attempts': profile.total_attempts,
-                'achievements': len(profile.achievements)
-            })
-    
-    stats_list.sort(key=lambda x: x['games_won'], reverse=True)
+    # Rows come back already shaped and sorted; the template reads them by attribute
+    stats_list = db.session.query(
+        User.name,
+        func.coalesce(User.email, 'Guest').label('email'),
+        PlayerProfile.games_won,
+        PlayerProfile.games_lost,
+        PlayerProfile.best_score,
+        PlayerProfile.current_streak.label('streak'),
+        PlayerProfile.total_attempts,
+        func.coalesce(func.json_array_length(PlayerProfile.achievements), 0).label('achievements')
+    ).join(PlayerProfile).order_by(PlayerProfile.games_won.desc()).all()
     
     return render_template('admin_dashboard.html',
         players=stats_list,
-        total_users=len(users))
+        total_users=User.query.count())
 
 @app.route('/admin/logout')
 def admin_logout():
@@ -593,12 +781,12 @@ def admin_logout():
 @app.route('/privacy')
 def privacy_policy():
     """Privacy Policy Page"""
-    return render_template('privacy.html')
+    return cacheable(render_template('privacy.html'), max_age=86400)
 
 @app.route('/terms')
 def terms_of_service():
     """Terms of Service Page"""
-    return render_template('terms.html')
+    return cacheable(render_template('terms.html'), max_age=86400)
 
 # ============== ERROR HANDLERS ==============
 
@@ -619,7 +807,7 @@ with app.app_context():
     if os.getenv('ENABLE_DB_CREATE', 'false').lower() == 'true':
         db.create_all()
     else:
-        app.logger.info('Database creation skipped — use Alembic migrations (ENABLE_DB_CREATE=true to force).')
+        log.info('Database creation skipped — use Alembic migrations (ENABLE_DB_CREATE=true to force).')
 
 if __name__ == '__main__':
     app.run(debug=app.config.get('DEBUG', False), host='0.0.0.0', port=5000)